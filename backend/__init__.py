@@ -5,6 +5,7 @@ __all__ = [
     "get_engine",
     "run_query",
     "get_table_schema",
+    "invalidate_schema_cache",
     "upload_new_table",
     "graph_agent",
 ]
@@ -12,8 +13,12 @@ __all__ = [
 # package metadata
 __version__ = "0.1.0"
 
+# configure logging once, before any submodule logs at import time
+from .logging_config import configure_logging
+configure_logging()
+
 # lightweight re-exports for convenience (no heavy initialization)
-from .database import get_engine
+from .database import get_engine, invalidate_schema_cache
 from .executer import run_query, get_table_schema
 from .upload_utils import upload_new_table
 from .agent import graph_agent
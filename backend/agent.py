@@ -1,36 +1,107 @@
 # backend/graph_agent.py
 
 import os
+import re
+import json
 import time
+import asyncio
 import logging
 from typing import TypedDict, Optional
 
+import sqlglot
+from sqlglot import exp
 from langgraph.graph import StateGraph, START, END
-from backend.sql_generator import generate_sql_gemini
-from backend.database import get_table_schema, get_all_table_names
+from langgraph.types import StreamWriter
+from backend.sql_generator import generate_sql_gemini, _clean_model_sql, _validate_sql, SQL_MAX_TOKENS
+from backend.database import get_table_schema, get_all_schemas_bulk
 from backend.executer import run_query
-
-# Azure OpenAI client import (keep existing library you use)
-from openai import AzureOpenAI
+from backend.openai_client import get_async_openai_client, AZURE_DEPLOYMENT
 from sqlalchemy.exc import SQLAlchemyError
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
 
-# Read Azure OpenAI settings from environment (do NOT hardcode credentials)
-AZURE_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT")
-AZURE_API_KEY = os.environ.get("AZURE_OPENAI_API_KEY")
-AZURE_API_VERSION = os.environ.get("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
-AZURE_DEPLOYMENT = os.environ.get("AZURE_OPENAI_DEPLOYMENT", "gpt-5-mini-2")
+# Lightweight deployment for the latency-sensitive routing step (falls back to the main deployment).
+# When it differs from AZURE_DEPLOYMENT the router only picks the table and SQL is still written
+# by the main deployment in generate_sql; otherwise one call picks the table and drafts the SQL.
+AZURE_OPENAI_ROUTER_DEPLOYMENT = os.environ.get("AZURE_OPENAI_ROUTER_DEPLOYMENT", AZURE_DEPLOYMENT)
 
-if not AZURE_ENDPOINT or not AZURE_API_KEY:
-    logger.warning("Azure OpenAI endpoint or API key not set in environment variables.")
+# Output caps per call: latency grows with every generated token (sent as max_completion_tokens,
+# which includes reasoning tokens on reasoning deployments)
+SUMMARY_MAX_TOKENS = int(os.environ.get("AZURE_OPENAI_SUMMARY_MAX_TOKENS", 4096))
+# Only the first rows of a result are passed to the summary prompt; prompt size must not grow with the result
+RESULT_SAMPLE_ROWS = int(os.environ.get("RESULT_SAMPLE_ROWS", 50))
+
+# Prompt templates, built once at import and filled with str.format per call
+_TABLE_SQL_PROMPT = """
+You are a data expert and a strict SQL generator.
+Given the user's query and available tables, choose the ONE table that best matches the query
+and convert the request into a SQL query against that table.
+
+Conversation so far:
+{memory}
+
+User Query: {query}
+Available Tables and Schemas:
+{schema_text}
+
+RULES:
+- Use only the chosen table and exactly its listed column names; do not guess or rename columns.
+- The SQL must be a single SELECT statement that references the chosen table.
+- Respond with a JSON object only, no explanation: {{"table": "<table name>", "sql": "<SQL query>"}}
+- If no table fits, respond with {{"table": "none", "sql": ""}}
+"""
+
+_TABLE_PROMPT = """
+You are a data expert.
+Given the user's query and available tables, choose the ONE table that best matches the query.
+
+Conversation so far:
+{memory}
+
+User Query: {query}
+Available Tables and Schemas:
+{schema_text}
+
+RULES:
+- Respond with a JSON object only, no explanation: {{"table": "<table name>"}}
+- If no table fits, respond with {{"table": "none"}}
+"""
+
+_FOLLOWUP_QUERY_PROMPT = "Conversation so far:\n{memory}\n\nUser Query: {query}\n"
+
+_SUMMARY_PROMPT = """
+Conversation Memory:
+{memory}
+
+User Query: {query}
+SQL Result (JSON: total row_count plus a sample of at most {sample_rows} rows):
+{result}
+Table: {table}
+
+Write a clear, detailed answer in full sentences.
+- Only describe the SQL result from table {table}.
+- Do not invent or switch to other datasets.
+- Always explain the result in context.
+- Include percentages or comparisons if relevant.
+- Do not suggest next steps or ask questions.
+"""
+
+# Explicit follow-up phrasings that reuse the previous turn's table and filters.
+# "males?" is matched as a whole word so questions about female users do not trigger the swap.
+_GENDER_SWAP_RE = re.compile(r"\b(?:what|how)\s+about\b.*\bmales?\b|\bsame\b.*\bmales?\b", re.IGNORECASE)
+_BREAKDOWN_RE = re.compile(r"\bbreak\s*(?:it\s+|that\s+)?down\b", re.IGNORECASE)
+
+
+def followup_kind(query: str) -> Optional[str]:
+    """
+    Return "gender_swap" or "breakdown" if query is one of the supported follow-up patterns, else None.
+    """
+    if _GENDER_SWAP_RE.search(query or ""):
+        return "gender_swap"
+    if _BREAKDOWN_RE.search(query or ""):
+        return "breakdown"
+    return None
 
-client = AzureOpenAI(
-    azure_endpoint=AZURE_ENDPOINT,
-    api_key=AZURE_API_KEY,
-    api_version=AZURE_API_VERSION,
-)
 
 class AgentState(TypedDict, total=False):
     query: str
@@ -44,55 +115,70 @@ class AgentState(TypedDict, total=False):
     last_group: Optional[str]
 
 
-def identify_table_step(state: AgentState) -> AgentState:
-    logger.info("Identifying best table for query: %s", state.get("query"))
-    # Reuse previously selected table unless the user explicitly asks for a different table
-    if state.get("table_name"):
-        logger.info("Reusing table: %s", state["table_name"])
-        return state
+def _extract_filters(sql: str) -> Optional[str]:
+    """
+    Return the top-level WHERE condition of sql (without the keyword), or None.
+    Parsed with sqlglot so keywords inside string literals or subqueries do not split the clause.
+    """
+    where = sqlglot.parse_one(sql, dialect="tsql").args.get("where")
+    return where.this.sql(dialect="tsql") if where else None
+
+
+def _swap_gender_filters(filters: str) -> str:
+    """
+    Rewrite equality comparisons against the 'female' string literal to 'male' in a filter condition.
+    """
+    condition = sqlglot.parse_one(filters, dialect="tsql")
+    for eq in list(condition.find_all(exp.EQ)):
+        for operand in (eq.this, eq.expression):
+            # T-SQL N'...' literals parse as exp.National rather than exp.Literal
+            is_string = isinstance(operand, exp.National) or (isinstance(operand, exp.Literal) and operand.is_string)
+            if is_string and operand.this.lower() == "female":
+                value = "Male" if operand.this[0].isupper() else "male"
+                operand.replace(exp.National(this=value) if isinstance(operand, exp.National) else exp.Literal.string(value))
+    return condition.sql(dialect="tsql")
 
+
+async def identify_table_step(state: AgentState) -> AgentState:
+    logger.info("Identifying best table for query: %s", state.get("query"))
     try:
-        all_tables = get_all_table_names()
+        # One round-trip for every table's columns instead of a lookup per table
+        table_schemas = await asyncio.to_thread(get_all_schemas_bulk)
     except Exception as e:
         logger.exception("Failed to list tables: %s", e)
         # leave table_name unset so generator will fail gracefully
         return state
 
     # Guard: if there are no tables, return
+    all_tables = list(table_schemas)
     if not all_tables:
         logger.warning("No tables found in database")
         return state
 
     # Build compact schema text for the prompt
-    table_schemas = {}
-    for t in all_tables:
-        try:
-            table_schemas[t] = get_table_schema(t)
-        except Exception:
-            table_schemas[t] = "(schema unavailable)"
-
     schema_text = "\n\n".join([f"Table: {t}\nColumns: {table_schemas[t]}" for t in table_schemas])
 
-    prompt = f"""
-You are a data expert.
-Given the user's query and available tables, choose the ONE table that best matches the query.
-
-User Query: {state.get('query')}
-Available Tables and Schemas:
-{schema_text}
-
-Return only the table name (no explanation). If no table fits, return 'none'.
-"""
+    # On the main deployment, choose the table and draft the SQL in a single completion to save
+    # a round-trip; a separate (smaller) router deployment only chooses the table
+    draft_sql = AZURE_OPENAI_ROUTER_DEPLOYMENT == AZURE_DEPLOYMENT
+    prompt = (_TABLE_SQL_PROMPT if draft_sql else _TABLE_PROMPT).format(
+        memory=state.get('memory', ''),
+        query=state.get('query'),
+        schema_text=schema_text,
+    )
 
     try:
-        response = client.chat.completions.create(
-            model=AZURE_DEPLOYMENT,
+        response = await get_async_openai_client().chat.completions.create(
+            model=AZURE_OPENAI_ROUTER_DEPLOYMENT,
             messages=[
                 {"role": "system", "content": "You are an intelligent SQL assistant."},
                 {"role": "user", "content": prompt},
             ],
+            max_completion_tokens=SQL_MAX_TOKENS,
+            response_format={"type": "json_object"},
         )
-        chosen_table = response.choices[0].message.content.strip()
+        choice = json.loads(response.choices[0].message.content)
+        chosen_table = str(choice.get("table") or "").strip()
         # Validate the chosen table
         if chosen_table.lower() == "none" or chosen_table not in all_tables:
             logger.warning("Model chose invalid or no table: %s", chosen_table)
@@ -100,13 +186,19 @@ Return only the table name (no explanation). If no table fits, return 'none'.
             return state
         state["table_name"] = chosen_table
         logger.info("Selected table: %s", chosen_table)
+
+        # Keep the drafted SQL only if it passes validation; otherwise generate_sql runs as a fallback
+        sql = _clean_model_sql(str(choice.get("sql") or ""))
+        if draft_sql and _validate_sql(sql, chosen_table):
+            state["sql"] = sql
+            logger.info("SQL generated together with table selection")
     except Exception as e:
         logger.exception("Table identification failed: %s", e)
 
     return state
 
 
-def generate_sql_step(state: AgentState) -> AgentState:
+async def generate_sql_step(state: AgentState) -> AgentState:
     table = state.get("table_name")
     logger.info("Generating SQL for table: %s", table)
 
@@ -116,22 +208,23 @@ def generate_sql_step(state: AgentState) -> AgentState:
 
     # Ensure table exists
     try:
-        schema = get_table_schema(table)
+        schema = await asyncio.to_thread(get_table_schema, table)
     except Exception as e:
         logger.exception("Failed to fetch schema for %s: %s", table, e)
         return state
 
     query_text = state.get("query", "").lower()
+    followup = followup_kind(query_text)
 
     # Gender-swap followup pattern
     try:
-        if "male" in query_text and state.get("filters"):
-            new_filters = state["filters"].replace("Female", "Male").replace("'female'", "'male'")
+        if followup == "gender_swap" and state.get("filters"):
+            new_filters = _swap_gender_filters(state["filters"])
             sql = f"SELECT * FROM {table} WHERE {new_filters};"
             state["filters"] = new_filters
             state["last_action"] = "select_records"
 
-        elif "break down" in query_text and state.get("filters"):
+        elif followup == "breakdown" and state.get("filters"):
             if "userage" in query_text:
                 group_col = "userage"
             elif "usergender" in query_text:
@@ -154,12 +247,9 @@ ORDER BY review_count DESC;
             state["last_group"] = group_col
 
         else:
-            enriched_query = f"Conversation so far:\n{state.get('memory','')}\n\nUser Query: {state.get('query')}\n"
+            enriched_query = _FOLLOWUP_QUERY_PROMPT.format(memory=state.get('memory', ''), query=state.get('query'))
             # generate_sql_gemini should be safe and return a full SQL string
-            sql = generate_sql_gemini(enriched_query, schema, table) or ""
-            # If filters exist and SQL lacks WHERE, append them (safe only if filters were generated internally)
-            if state.get("filters") and "WHERE" not in sql.upper():
-                sql = sql.strip().rstrip(";") + f"\nWHERE {state['filters']};"
+            sql = await asyncio.to_thread(generate_sql_gemini, enriched_query, schema, table) or ""
 
         # Final sanity: sql must be non-empty and start with SELECT
         if not sql or not sql.strip().lower().startswith("select"):
@@ -175,7 +265,7 @@ ORDER BY review_count DESC;
     return state
 
 
-def execute_sql_step(state: AgentState) -> AgentState:
+async def execute_sql_step(state: AgentState) -> AgentState:
     sql = state.get("sql")
     logger.info("Executing SQL query...")
     if not sql:
@@ -185,14 +275,18 @@ def execute_sql_step(state: AgentState) -> AgentState:
     try:
         t0 = time.time()
         # run_query should return list of dict rows
-        rows = run_query(sql)
+        rows = await asyncio.to_thread(run_query, sql)
         duration = time.time() - t0
         logger.info("Query executed in %.2fs; rows=%d", duration, len(rows) if isinstance(rows, list) else 0)
-        state["result"] = str(rows)
-        # Capture filters safely (only if SQL contained a WHERE)
-        if "WHERE" in sql.upper():
-            where_clause = sql.split("WHERE", 1)[1]
-            where_clause = where_clause.split("GROUP BY")[0].split("ORDER BY")[0].strip()
+        # default=str covers Decimal / date values returned by the driver
+        state["result"] = json.dumps({"row_count": len(rows), "sample": rows[:RESULT_SAMPLE_ROWS]}, default=str)
+        # Capture filters safely (only if SQL contained a top-level WHERE)
+        try:
+            where_clause = _extract_filters(sql)
+        except sqlglot.errors.SqlglotError as e:
+            logger.warning("Could not parse SQL to capture filters: %s", e)
+            where_clause = None
+        if where_clause:
             state["filters"] = where_clause
             logger.info("Captured filters: %s", state["filters"])
     except SQLAlchemyError as e:
@@ -205,35 +299,38 @@ def execute_sql_step(state: AgentState) -> AgentState:
     return state
 
 
-def summarize_step(state: AgentState) -> AgentState:
+async def summarize_step(state: AgentState, writer: StreamWriter) -> AgentState:
     logger.info("Summarizing results into natural language...")
 
-    summary_prompt = f"""
-Conversation Memory:
-{state.get('memory', 'None')}
-
-User Query: {state.get('query')}
-SQL Result: {state.get('result')}
-Table: {state.get('table_name')}
-
-Write a clear, detailed answer in full sentences.
-- Only describe the SQL result from table {state.get('table_name')}.
-- Do not invent or switch to other datasets.
-- Always explain the result in context.
-- Include percentages or comparisons if relevant.
-- Do not suggest next steps or ask questions.
-"""
+    summary_prompt = _SUMMARY_PROMPT.format(
+        memory=state.get('memory', 'None'),
+        query=state.get('query'),
+        result=state.get('result'),
+        sample_rows=RESULT_SAMPLE_ROWS,
+        table=state.get('table_name'),
+    )
 
     try:
-        response = client.chat.completions.create(
+        # Stream tokens so callers using stream_mode="custom" see the answer as it is generated
+        response = await get_async_openai_client().chat.completions.create(
             model=AZURE_DEPLOYMENT,
             messages=[
                 {"role": "system", "content": "You are a helpful data analyst who speaks in plain English."},
                 {"role": "user", "content": summary_prompt},
             ],
-            # you can add request-specific timeouts/config here if supported
+            max_completion_tokens=SUMMARY_MAX_TOKENS,
+            stream=True,
         )
-        answer = response.choices[0].message.content.strip()
+        parts = []
+        async for chunk in response:
+            # Azure may send chunks without choices (e.g. content filter results)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            if delta:
+                parts.append(delta)
+                writer({"token": delta})
+        answer = "".join(parts).strip()
         state["answer"] = answer
         previous_memory = state.get("memory", "")
         state["memory"] = f"{previous_memory}\nUser: {state.get('query')}\nAI: {answer}\n"
@@ -245,14 +342,36 @@ Write a clear, detailed answer in full sentences.
     return state
 
 
+def _route_from_start(state: AgentState) -> str:
+    # Explicit follow-ups reuse the previous turn's table, so skip the table-selection LLM call;
+    # every other question picks its table afresh
+    if state.get("table_name") and followup_kind(state.get("query", "")):
+        logger.info("Reusing table: %s", state["table_name"])
+        return "generate"
+    return "identify"
+
+
+def _route_after_identify(state: AgentState) -> str:
+    # identify_table usually drafts the SQL too; only fall back to generate_sql when it did not
+    return "execute_sql" if state.get("sql") else "generate_sql"
+
+
 # Build LangGraph Flow
 agent_graph = StateGraph(AgentState)
 agent_graph.add_node("identify_table", identify_table_step)
 agent_graph.add_node("generate_sql", generate_sql_step)
 agent_graph.add_node("execute_sql", execute_sql_step)
 agent_graph.add_node("summarize", summarize_step)
-agent_graph.add_edge(START, "identify_table")
-agent_graph.add_edge("identify_table", "generate_sql")
+agent_graph.add_conditional_edges(
+    START,
+    _route_from_start,
+    {"identify": "identify_table", "generate": "generate_sql"},
+)
+agent_graph.add_conditional_edges(
+    "identify_table",
+    _route_after_identify,
+    {"execute_sql": "execute_sql", "generate_sql": "generate_sql"},
+)
 agent_graph.add_edge("generate_sql", "execute_sql")
 agent_graph.add_edge("execute_sql", "summarize")
 agent_graph.add_edge("summarize", END)
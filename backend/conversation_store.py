@@ -0,0 +1,109 @@
+# backend/conversation_store.py
+import os
+import json
+import sqlite3
+import logging
+from contextlib import closing
+from typing import List, Dict
+
+logger = logging.getLogger(__name__)
+
+# SQLite file shared by all workers on the host (use a mounted volume in containers)
+CONVERSATION_DB_PATH = os.environ.get("CONVERSATION_DB_PATH", "conversation_history.db")
+# Only the most recent turns are replayed into the prompt, keeping prompt size bounded
+HISTORY_WINDOW_TURNS = int(os.environ.get("HISTORY_WINDOW_TURNS", 6))
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS conversation_turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    user_text TEXT NOT NULL,
+    bot_text TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS ix_conversation_turns_session
+    ON conversation_turns (session_id, id);
+CREATE TABLE IF NOT EXISTS session_context (
+    session_id TEXT PRIMARY KEY,
+    context TEXT NOT NULL
+);
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    # One short-lived connection per call: sqlite3 connections must not be shared across threads
+    return sqlite3.connect(CONVERSATION_DB_PATH, timeout=30)
+
+
+def init_store():
+    """
+    Create the conversation table if needed and enable WAL so readers do not block writers.
+    """
+    with closing(_connect()) as conn:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.executescript(_SCHEMA_SQL)
+    logger.info("Conversation store ready at %s", CONVERSATION_DB_PATH)
+
+
+def append_turn(session_id: str, user_text: str, bot_text: str):
+    """
+    Persist one user/assistant exchange for a session.
+    """
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "INSERT INTO conversation_turns (session_id, user_text, bot_text) VALUES (?, ?, ?)",
+            (session_id, user_text, bot_text),
+        )
+
+
+def recent_turns(session_id: str, limit: int = HISTORY_WINDOW_TURNS) -> List[Dict]:
+    """
+    Return the last `limit` turns of a session, oldest first, as {"user": ..., "bot": ...} dicts.
+    """
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            "SELECT user_text, bot_text FROM conversation_turns "
+            "WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, int(limit)),
+        ).fetchall()
+    return [{"user": user_text, "bot": bot_text} for user_text, bot_text in reversed(rows)]
+
+
+def list_sessions() -> List[str]:
+    """
+    Return the ids of all sessions that have at least one stored turn.
+    """
+    with closing(_connect()) as conn:
+        rows = conn.execute("SELECT DISTINCT session_id FROM conversation_turns").fetchall()
+    return [row[0] for row in rows]
+
+
+def load_context(session_id: str) -> Dict:
+    """
+    Return the agent context (selected table, filters, ...) saved for a session, or {}.
+    """
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT context FROM session_context WHERE session_id = ?", (session_id,)
+        ).fetchone()
+    return json.loads(row[0]) if row else {}
+
+
+def save_context(session_id: str, context: Dict):
+    """
+    Replace the agent context saved for a session.
+    """
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO session_context (session_id, context) VALUES (?, ?)",
+            (session_id, json.dumps(context)),
+        )
+
+
+def clear_session(session_id: str):
+    """
+    Delete a session's stored turns and agent context.
+    """
+    with closing(_connect()) as conn, conn:
+        conn.execute("DELETE FROM conversation_turns WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM session_context WHERE session_id = ?", (session_id,))
@@ -1,13 +1,14 @@
 # backend/database.py
 import os
+import time
 import logging
+import functools
 from urllib.parse import quote_plus
 from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.exc import OperationalError
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
 
 # Optional: load .env during local development
 # Install python-dotenv and uncomment the next two lines if you want .env support
@@ -43,24 +44,82 @@ def _build_connection_string():
     # Use odbc_connect param to avoid embedding server/db in the URL path
     return f"mssql+pyodbc://{user}:{pwd}@/?odbc_connect={odbc_conn}"
 
-# Engine singleton
-_engine = None
+# Optional full SQLAlchemy URL (e.g. postgresql+psycopg2://...); overrides the AZ_SQL_* settings
+DATABASE_URL = os.environ.get("DATABASE_URL")
 
+@functools.lru_cache(maxsize=1)
 def get_engine():
-    global _engine
-    if _engine is None:
-        conn_str = _build_connection_string()
-        # Tune pool settings for production load
-        _engine = create_engine(
-            conn_str,
-            pool_size=int(os.environ.get("DB_POOL_SIZE", 10)),
-            max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 20)),
-            pool_pre_ping=True,
-            pool_timeout=int(os.environ.get("DB_POOL_TIMEOUT", 30)),
-            connect_args={"timeout": int(os.environ.get("DB_CONNECT_TIMEOUT", 30))},
+    """
+    Return the process-wide pooled engine, creating it on first use.
+    """
+    conn_str = DATABASE_URL or _build_connection_string()
+    # Tune pool settings for production load
+    kwargs = dict(
+        pool_size=int(os.environ.get("DB_POOL_SIZE", 10)),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 20)),
+        pool_pre_ping=True,
+        pool_timeout=int(os.environ.get("DB_POOL_TIMEOUT", 30)),
+    )
+    if conn_str.startswith("mssql+pyodbc"):
+        kwargs.update(
+            # pyodbc: send executemany() batches as packed parameter arrays (bulk inserts in
+            # upload_new_table) and skip the per-parameter setinputsizes() round of calls
+            fast_executemany=True,
+            use_setinputsizes=False,
+            connect_args={
+                "timeout": int(os.environ.get("DB_CONNECT_TIMEOUT", 30)),
+                "autocommit": False,
+            },
         )
-        logger.info("SQLAlchemy engine created")
-    return _engine
+    engine = create_engine(conn_str, **kwargs)
+    logger.info("SQLAlchemy engine created")
+    return engine
+
+# Schema metadata rarely changes between requests, so lookups are memoized. Entries expire
+# after SCHEMA_CACHE_TTL_SECONDS so workers that did not run an upload still pick up new or
+# replaced tables; the uploading process also drops them explicitly via invalidate_schema_cache()
+SCHEMA_CACHE_SIZE = int(os.environ.get("SCHEMA_CACHE_SIZE", 256))
+SCHEMA_CACHE_TTL_SECONDS = float(os.environ.get("SCHEMA_CACHE_TTL_SECONDS", 300))
+_schema_caches = []
+_schema_cache_expires_at = 0.0
+
+def schema_cache(func):
+    """
+    Memoize a schema lookup with functools.lru_cache, expiring all schema lookups together
+    after SCHEMA_CACHE_TTL_SECONDS, and register it so invalidate_schema_cache() can clear it.
+    """
+    cached = functools.lru_cache(maxsize=SCHEMA_CACHE_SIZE)(func)
+    _schema_caches.append(cached)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if time.monotonic() >= _schema_cache_expires_at:
+            invalidate_schema_cache()
+        return cached(*args, **kwargs)
+
+    wrapper.cache_clear = cached.cache_clear
+    return wrapper
+
+def invalidate_schema_cache():
+    """
+    Clear all memoized schema lookups. Call after creating, replacing or dropping tables.
+    """
+    global _inspector, _schema_cache_expires_at
+    for cached in _schema_caches:
+        cached.cache_clear()
+    _inspector = None
+    _schema_cache_expires_at = time.monotonic() + SCHEMA_CACHE_TTL_SECONDS
+    logger.debug("Schema cache invalidated")
+
+# Inspector singleton. SQLAlchemy's Inspector memoizes reflection results itself,
+# so it is discarded whenever the schema cache is invalidated.
+_inspector = None
+
+def _get_inspector():
+    global _inspector
+    if _inspector is None:
+        _inspector = inspect(get_engine())
+    return _inspector
 
 # Retry transient DB connection errors
 @retry(
@@ -75,19 +134,25 @@ def _connect_and_execute(sql_text, params=None):
         result = conn.execute(text(sql_text), params or {})
         return result
 
+def table_exists(table_name: str) -> bool:
+    """
+    Return True if a base table with this name exists (parameterized single-row lookup).
+    """
+    sql = "SELECT 1 FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = :n AND TABLE_TYPE = 'BASE TABLE';"
+    return _connect_and_execute(sql, {"n": table_name}).first() is not None
+
+@schema_cache
 def get_table_schema(table_name: str):
     """
     Returns a dict of column_name: data_type for the requested table.
     Validates that the table exists and raises ValueError if not present.
     """
-    engine = get_engine()
-    inspector = inspect(engine)
-    tables = inspector.get_table_names()
-    if table_name not in tables:
+    if not table_exists(table_name):
         raise ValueError(f"Table not found: {table_name}")
-    columns = inspector.get_columns(table_name)
+    columns = _get_inspector().get_columns(table_name)
     return {col["name"]: str(col["type"]) for col in columns}
 
+@schema_cache
 def get_all_table_names():
     """
     Returns a list of all base table names in the database.
@@ -96,16 +161,33 @@ def get_all_table_names():
     rows = _connect_and_execute(sql)
     return [row[0] for row in rows]
 
+@schema_cache
+def get_all_schemas_bulk():
+    """
+    Returns {table_name: {column_name: data_type}} for every base table,
+    fetched with a single INFORMATION_SCHEMA query instead of one lookup per table.
+    """
+    sql = (
+        "SELECT c.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE "
+        "FROM INFORMATION_SCHEMA.COLUMNS c "
+        "JOIN INFORMATION_SCHEMA.TABLES t "
+        "ON c.TABLE_SCHEMA = t.TABLE_SCHEMA AND c.TABLE_NAME = t.TABLE_NAME "
+        "WHERE t.TABLE_TYPE='BASE TABLE' "
+        "ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION;"
+    )
+    rows = _connect_and_execute(sql)
+    schemas = {}
+    for table_name, column_name, data_type in rows:
+        schemas.setdefault(table_name, {})[column_name] = data_type
+    return schemas
+
 def safe_select_all(table_name: str, limit: int = 1000):
     """
     Return rows for a table with a safety limit to avoid huge payloads.
     Use parameterized queries for any values; table_name is validated.
     """
     # validate table name exists
-    engine = get_engine()
-    inspector = inspect(engine)
-    tables = inspector.get_table_names()
-    if table_name not in tables:
+    if not table_exists(table_name):
         raise ValueError(f"Table not found: {table_name}")
 
     # Build safe SQL (table name validated above)
@@ -6,35 +6,9 @@ import pandas as pd
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 
-from backend.database import get_engine
+from backend.database import get_engine, schema_cache, table_exists
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
-
-
-def _normalize_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Convert NaN -> None and convert numpy / pandas scalar types to native Python types.
-    Avoid deprecated DataFrame.applymap by mapping per-column.
-    """
-    if df.empty:
-        return df
-
-    # Replace pandas NaN with None
-    df = df.where(pd.notnull(df), None)
-
-    # Convert numpy/pandas scalar types to python scalars
-    def _to_python_scalar(x):
-        try:
-            return x.item() if hasattr(x, "item") else x
-        except Exception:
-            return x
-
-    # Apply per-column mapping (avoids deprecated applymap)
-    for col in df.columns:
-        df[col] = df[col].map(_to_python_scalar)
-
-    return df
 
 
 def run_query(sql: str, limit: Optional[int] = None, timeout: Optional[int] = None) -> List[Dict]:
@@ -42,7 +16,7 @@ def run_query(sql: str, limit: Optional[int] = None, timeout: Optional[int] = No
     Execute a read-only SQL query and return a list of dict rows.
 
     - sql: raw SQL string (should be constructed carefully; prefer parameterized helpers)
-    - limit: optional max number of rows to return (appends TOP clause for SQL Server)
+    - limit: optional max number of rows to return (only that many rows are fetched from the cursor)
     - timeout: optional query timeout in seconds (passed via execution options if supported)
 
     NOTE: This function executes the provided SQL as-is. Make sure any user-provided
@@ -50,26 +24,14 @@ def run_query(sql: str, limit: Optional[int] = None, timeout: Optional[int] = No
     """
     engine = get_engine()
 
-    # If a limit is provided and the query starts with SELECT, attempt to enforce a TOP for SQL Server
-    final_sql = sql
-    if limit is not None:
-        stripped = sql.lstrip().lower()
-        if stripped.startswith("select"):
-            # a simple heuristic: insert TOP (n) after SELECT
-            final_sql = sql.lstrip()
-            # preserve 'SELECT DISTINCT' case
-            if final_sql[:15].lower().startswith("select distinct"):
-                final_sql = final_sql[:15] + f" TOP ({int(limit)}) " + final_sql[15:]
-            else:
-                final_sql = "SELECT TOP ({}) ".format(int(limit)) + final_sql[6:]
-        else:
-            logger.debug("Limit provided but SQL does not start with SELECT; ignoring limit")
-
     try:
-        # Use pandas read_sql with SQLAlchemy engine; text() used when needed
-        df = pd.read_sql(text(final_sql), con=engine)
-        df = _normalize_dataframe(df)
-        return df.to_dict(orient="records")
+        # Fetch rows as mappings directly; the DBAPI already returns Python scalars and None for NULL
+        with engine.connect() as conn:
+            result = conn.execute(text(sql)).mappings()
+            # Cap rows on the cursor instead of rewriting the SQL, so CTEs, DISTINCT,
+            # ORDER BY and leading comments are all handled the same way
+            rows = result.all() if limit is None else result.fetchmany(int(limit))
+        return [dict(r) for r in rows]
     except SQLAlchemyError as e:
         logger.exception("Database query failed: %s", e)
         raise
@@ -78,6 +40,7 @@ def run_query(sql: str, limit: Optional[int] = None, timeout: Optional[int] = No
         raise
 
 
+@schema_cache
 def get_table_schema(table_name: str) -> str:
     """
     Return a comma-separated list of column names for a validated table.
@@ -87,10 +50,8 @@ def get_table_schema(table_name: str) -> str:
     """
     engine = get_engine()
     try:
-        # Validate table exists via inspector for extra safety (optional)
-        inspector = engine.dialect.get_inspector(engine)
-        all_tables = inspector.get_table_names()
-        if table_name not in all_tables:
+        # Validate table exists with a parameterized single-row lookup
+        if not table_exists(table_name):
             raise ValueError(f"Table not found: {table_name}")
 
         sql = text("""
@@ -0,0 +1,32 @@
+# backend/logging_config.py
+import os
+import logging.config
+
+# Root log level for the backend (e.g. DEBUG, INFO, WARNING)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+LOGGING_CONFIG = {
+    "version": 1,
+    # Keep loggers created before configuration (uvicorn, sqlalchemy, ...) working
+    "disable_existing_loggers": False,
+    "formatters": {
+        "default": {"format": "%(levelname)s:%(name)s:%(message)s"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "default"},
+    },
+    "root": {"level": LOG_LEVEL, "handlers": ["console"]},
+}
+
+_configured = False
+
+
+def configure_logging():
+    """
+    Apply the backend logging configuration once per process.
+    """
+    global _configured
+    if _configured:
+        return
+    logging.config.dictConfig(LOGGING_CONFIG)
+    _configured = True
@@ -1,29 +1,34 @@
 # backend/main.py
 
 import os
+import json
 import shutil
+import hashlib
 import logging
 import asyncio
-from typing import List
+from typing import Dict, List
+import aiofiles
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from pathlib import Path
 from werkzeug.utils import secure_filename  # pip install Werkzeug
 
 # Import your agent and upload helper
-from backend.agent import graph_agent
+from backend.agent import graph_agent, followup_kind
 from backend.upload_utils import upload_new_table
+from backend import conversation_store
 
 # Configuration
 UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "uploaded_files")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 MAX_UPLOAD_SIZE_BYTES = int(os.environ.get("MAX_UPLOAD_SIZE_BYTES", 50 * 1024 * 1024))  # 50 MB default
+UPLOAD_READ_CHUNK_BYTES = 1 << 20  # uploads are copied to disk 1 MB at a time
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 4))  # graph runs in flight per batch request
 
 # Logging
-logger = logging.getLogger("backend")
-logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # FastAPI app
 app = FastAPI(title="Conversational SQL Agent")
@@ -38,8 +43,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Simple in-memory conversation storage (replace with DB for persistence)
-conversation_history = {}
+# Conversation history is persisted in SQLite; only the last HISTORY_WINDOW_TURNS are replayed
+conversation_store.init_store()
+
+# Agent state saved after each turn; restored only when the next query is an explicit
+# follow-up ("what about male users?", "break it down"), so other questions start fresh
+SESSION_CONTEXT_KEYS = ("table_name", "filters", "last_group")
+
+# Graph runs currently in flight, keyed by session + query, so identical concurrent requests share one run
+_inflight: Dict[str, asyncio.Future] = {}
 
 # Pydantic models
 class AskRequest(BaseModel):
@@ -47,10 +59,10 @@ class AskRequest(BaseModel):
     session_id: str = "default"
 
 # Helpers
-def _save_upload_file_tmp(upload_file: UploadFile, dest_dir: str) -> str:
+async def _save_upload_file_tmp(upload_file: UploadFile, dest_dir: str) -> str:
     """
-    Save uploaded file to dest_dir and return the file path.
-    Uses secure_filename to avoid path traversal.
+    Stream uploaded file to dest_dir in chunks and return the file path.
+    Uses secure_filename to avoid path traversal. Raises 413 as soon as the size limit is crossed.
     """
     filename = secure_filename(upload_file.filename)
     if not filename:
@@ -69,20 +81,85 @@ def _save_upload_file_tmp(upload_file: UploadFile, dest_dir: str) -> str:
                 break
             i += 1
 
-    # Write file
-    with open(dest_path, "wb") as f:
-        data = upload_file.file.read()
-        if len(data) > MAX_UPLOAD_SIZE_BYTES:
-            raise HTTPException(status_code=413, detail="Uploaded file too large")
-        f.write(data)
+    # Write file chunk by chunk so memory use stays at one chunk regardless of upload size
+    total = 0
+    try:
+        async with aiofiles.open(dest_path, "wb") as f:
+            while chunk := await upload_file.read(UPLOAD_READ_CHUNK_BYTES):
+                total += len(chunk)
+                if total > MAX_UPLOAD_SIZE_BYTES:
+                    raise HTTPException(status_code=413, detail="Uploaded file too large")
+                await f.write(chunk)
+    except Exception:
+        # do not leave a partial file behind
+        dest_path.unlink(missing_ok=True)
+        raise
     # Reset file pointer for downstream libs (though we wrote content already)
     try:
-        upload_file.file.seek(0)
+        await upload_file.seek(0)
     except Exception:
         pass
 
     return str(dest_path)
 
+async def _build_initial_state(user_query: str, session_id: str) -> dict:
+    """
+    Build the graph input state, reconstructing memory from the recent conversation window.
+    For follow-up queries the previous turn's context (selected table, filters) is restored too.
+    """
+    previous_conversation = await asyncio.to_thread(conversation_store.recent_turns, session_id)
+    context = {}
+    if followup_kind(user_query):
+        context = await asyncio.to_thread(conversation_store.load_context, session_id)
+    memory_text = "\n".join([f"User: {turn['user']}\nAI: {turn['bot']}" for turn in previous_conversation])
+    return {
+        **context,
+        "query": user_query,
+        "memory": memory_text,
+    }
+
+async def _record_turn(session_id: str, user_query: str, answer: str, final_state: dict) -> List[dict]:
+    """
+    Persist a completed turn and its session context, and return the session's recent conversation window.
+    """
+    context = {k: final_state[k] for k in SESSION_CONTEXT_KEYS if final_state.get(k)}
+    await asyncio.to_thread(conversation_store.append_turn, session_id, user_query, answer)
+    await asyncio.to_thread(conversation_store.save_context, session_id, context)
+    return await asyncio.to_thread(conversation_store.recent_turns, session_id)
+
+async def _answer_query(user_query: str, session_id: str):
+    """
+    Run the graph for one query and persist the turn. Returns (answer, conversation_window).
+    """
+    # Build initial state with memory reconstructed from the stored conversation window
+    state = await _build_initial_state(user_query, session_id)
+    # Graph nodes are async (blocking DB work is offloaded inside them), so await directly
+    result = await graph_agent.ainvoke(state)
+
+    # Normalize and store response
+    answer = result.get("answer") or result.get("response") or "No response generated."
+    previous_conversation = await _record_turn(session_id, user_query, answer, result)
+    return answer, previous_conversation
+
+async def _answer_query_coalesced(user_query: str, session_id: str):
+    """
+    Like _answer_query, but a duplicate of a query that is still running awaits the first run's result.
+    """
+    key = hashlib.sha256(f"{session_id}\x00{user_query.strip()}".encode()).hexdigest()
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_answer_query(user_query, session_id))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        logger.info("Coalescing duplicate in-flight query for session %s", session_id)
+    # shield: a disconnecting caller must not cancel the run other callers are waiting on
+    return await asyncio.shield(task)
+
+def _sse_frame(payload: dict) -> str:
+    # JSON-encode each event so tokens containing newlines do not break SSE framing
+    return f"data: {json.dumps(payload)}\n\n"
+
 # Endpoint: upload a new table (async wrapper)
 @app.post("/upload_new_table")
 async def upload_new_table_api(file: UploadFile = File(...), table_name: str = Form(...)):
@@ -92,7 +169,7 @@ async def upload_new_table_api(file: UploadFile = File(...), table_name: str = F
             raise HTTPException(status_code=400, detail="table_name is required")
 
         # Save file safely
-        saved_path = await asyncio.to_thread(_save_upload_file_tmp, file, UPLOAD_DIR)
+        saved_path = await _save_upload_file_tmp(file, UPLOAD_DIR)
 
         # Run upload utility in thread to avoid blocking
         result = await asyncio.to_thread(upload_new_table, saved_path, table_name.strip())
@@ -113,32 +190,77 @@ async def ask_graph_agent(request: AskRequest):
     if not user_query or not user_query.strip():
         raise HTTPException(status_code=400, detail="user_query is required")
 
-    # Reconstruct memory from in-memory conversation_history
-    previous_conversation = conversation_history.get(session_id, [])
-    memory_text = "\n".join([f"User: {turn['user']}\nAI: {turn['bot']}" for turn in previous_conversation])
-
-    # Build initial state
-    state = {
-        "query": user_query,
-        "memory": memory_text,
-    }
-
     try:
-        # Run potentially blocking graph_agent.invoke() in threadpool so FastAPI event loop remains responsive
-        loop = asyncio.get_running_loop()
-        result = await loop.run_in_executor(None, graph_agent.invoke, state)
-
-        # Normalize and store response
-        answer = result.get("answer") or result.get("response") or "No response generated."
-        previous_conversation.append({"user": user_query, "bot": answer})
-        conversation_history[session_id] = previous_conversation
-
+        answer, previous_conversation = await _answer_query_coalesced(user_query, session_id)
         return {"response": answer, "conversation": previous_conversation}
     except Exception as e:
         logger.exception("ask_graph_agent failed: %s", e)
         # Return a 500 with trace information suppressed for security
         return JSONResponse(status_code=500, content={"error": "Internal server error", "detail": str(e)})
 
+# Endpoint: answer several queries in one request (dashboards / offline evaluation)
+@app.post("/ask_graph_agent_batch")
+async def ask_graph_agent_batch(requests: List[AskRequest]):
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def _run(item: AskRequest) -> dict:
+        session_id = item.session_id or "default"
+        entry = {"session_id": session_id, "user_query": item.user_query}
+        if not item.user_query or not item.user_query.strip():
+            entry["error"] = "user_query is required"
+            return entry
+        async with semaphore:
+            try:
+                entry["response"], _ = await _answer_query_coalesced(item.user_query, session_id)
+            except Exception as e:
+                logger.exception("Batch item failed: %s", e)
+                entry["error"] = str(e)
+        return entry
+
+    # Items of one session read and write the same history/context, so they run in submission
+    # order; different sessions run concurrently
+    by_session: Dict[str, List[int]] = {}
+    for index, item in enumerate(requests):
+        by_session.setdefault(item.session_id or "default", []).append(index)
+
+    results: List[dict] = [None] * len(requests)
+
+    async def _run_session(indexes: List[int]):
+        for index in indexes:
+            results[index] = await _run(requests[index])
+
+    # Results keep the order of the submitted queries; one failure does not fail the batch
+    await asyncio.gather(*(_run_session(indexes) for indexes in by_session.values()))
+    return {"results": results}
+
+# Endpoint: ask the graph agent, streaming the answer as Server-Sent Events
+@app.post("/ask_graph_agent/stream")
+async def ask_graph_agent_stream(request: AskRequest):
+    user_query = request.user_query
+    session_id = request.session_id or "default"
+
+    if not user_query or not user_query.strip():
+        raise HTTPException(status_code=400, detail="user_query is required")
+
+    state = await _build_initial_state(user_query, session_id)
+
+    async def event_stream():
+        final_state = {}
+        try:
+            async for mode, chunk in graph_agent.astream(state, stream_mode=["custom", "values"]):
+                if mode == "custom":
+                    yield _sse_frame({"token": chunk.get("token", "")})
+                else:
+                    final_state = chunk
+            answer = final_state.get("answer") or "No response generated."
+            previous_conversation = await _record_turn(session_id, user_query, answer, final_state)
+            yield _sse_frame({"done": True, "response": answer, "conversation": previous_conversation})
+        except Exception as e:
+            logger.exception("ask_graph_agent_stream failed: %s", e)
+            yield _sse_frame({"error": "Internal server error", "detail": str(e)})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 # Health-check endpoint
 @app.get("/health")
 async def health():
@@ -147,4 +269,11 @@ async def health():
 # Simple endpoint to list sessions (for debugging)
 @app.get("/sessions")
 async def list_sessions():
-    return {"sessions": list(conversation_history.keys())}
+    sessions = await asyncio.to_thread(conversation_store.list_sessions)
+    return {"sessions": sessions}
+
+# Forget a session's stored conversation and context (frontend "Reset conversation")
+@app.delete("/sessions/{session_id}")
+async def clear_session(session_id: str):
+    await asyncio.to_thread(conversation_store.clear_session, session_id)
+    return {"status": "ok"}
@@ -0,0 +1,61 @@
+# backend/openai_client.py
+import os
+import logging
+import threading
+from typing import Optional
+
+import httpx
+from openai import AzureOpenAI, AsyncAzureOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+logger = logging.getLogger(__name__)
+
+# Read Azure OpenAI settings from environment (do NOT hardcode credentials)
+AZURE_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT")
+AZURE_API_KEY = os.environ.get("AZURE_OPENAI_API_KEY")
+AZURE_API_VERSION = os.environ.get("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
+AZURE_DEPLOYMENT = os.environ.get("AZURE_OPENAI_DEPLOYMENT", "gpt-5-mini-2")
+
+if not AZURE_ENDPOINT or not AZURE_API_KEY:
+    logger.warning("Azure OpenAI endpoint or API key not set in environment variables.")
+
+# Keep-alive pool shared by every call made through a client (HTTP/2 multiplexes requests on it)
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32)
+
+# Client singletons: one sync client (sql_generator) and one async client (graph nodes)
+_lock = threading.Lock()
+_client: Optional[AzureOpenAI] = None
+_async_client: Optional[AsyncAzureOpenAI] = None
+
+
+def get_openai_client() -> AzureOpenAI:
+    """
+    Return the process-wide synchronous Azure OpenAI client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = AzureOpenAI(
+                    azure_endpoint=AZURE_ENDPOINT,
+                    api_key=AZURE_API_KEY,
+                    api_version=AZURE_API_VERSION,
+                    http_client=DefaultHttpxClient(http2=True, limits=_HTTP_LIMITS),
+                )
+    return _client
+
+
+def get_async_openai_client() -> AsyncAzureOpenAI:
+    """
+    Return the process-wide asynchronous Azure OpenAI client, creating it on first use.
+    """
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                _async_client = AsyncAzureOpenAI(
+                    azure_endpoint=AZURE_ENDPOINT,
+                    api_key=AZURE_API_KEY,
+                    api_version=AZURE_API_VERSION,
+                    http_client=DefaultAsyncHttpxClient(http2=True, limits=_HTTP_LIMITS),
+                )
+    return _async_client
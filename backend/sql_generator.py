@@ -2,35 +2,36 @@
 import os
 import logging
 import time
-from typing import Optional
 
-from openai import AzureOpenAI
+from backend.openai_client import get_openai_client, AZURE_DEPLOYMENT
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
 
-# Read Azure OpenAI config from environment (do NOT hardcode)
-AZURE_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT")
-AZURE_API_KEY = os.environ.get("AZURE_OPENAI_API_KEY")
-AZURE_DEPLOYMENT = os.environ.get("AZURE_OPENAI_DEPLOYMENT", "gpt-5-mini-2")
-AZURE_API_VERSION = os.environ.get("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
+# Generated SQL is short; cap output instead of letting the model generate up to the deployment
+# default. Sent as max_completion_tokens, which on reasoning deployments (gpt-5*) also covers
+# reasoning tokens, so the default leaves room for those.
+SQL_MAX_TOKENS = int(os.environ.get("AZURE_OPENAI_SQL_MAX_TOKENS", 2048))
+# Optional comma-separated stop sequences (e.g. ";"). Empty by default because reasoning
+# deployments reject the stop parameter; code fences are stripped by _clean_model_sql instead.
+SQL_STOP_SEQUENCES = [s for s in os.environ.get("AZURE_OPENAI_SQL_STOP", "").split(",") if s]
 
-if not AZURE_ENDPOINT or not AZURE_API_KEY:
-    logger.warning("Azure OpenAI endpoint or API key not found in environment variables.")
+# Prompt template, built once at import and filled with str.format per call
+_SQL_PROMPT = """
+You are an SQL expert. Convert the user request into a valid SQL query ONLY.
 
-_client: Optional[AzureOpenAI] = None
+TABLE NAME: {table_name}
 
+COLUMNS (use exactly these, comma-separated):
+{schema}
 
-def _get_client() -> AzureOpenAI:
-    global _client
-    if _client is None:
-        _client = AzureOpenAI(
-            azure_endpoint=AZURE_ENDPOINT,
-            api_key=AZURE_API_KEY,
-            api_version=AZURE_API_VERSION,
-        )
-    return _client
+RULES:
+- Use only the table `{table_name}`.
+- Do not guess or rename columns; use exactly the provided column names.
+- Return ONLY the SQL query. No explanation, no commentary, no code fences.
+- Ensure the query is a SELECT statement and references the table name.
 
+User Query: {user_query}
+"""
 
 def _clean_model_sql(text: str) -> str:
     """
@@ -66,24 +67,9 @@ def generate_sql_gemini(user_query: str, schema: str, table_name: str, max_retri
     Generate SQL using Azure OpenAI. Returns validated SQL string (single-line).
     Raises RuntimeError on failure or validation errors.
     """
-    client = _get_client()
-
-    prompt = f"""
-You are an SQL expert. Convert the user request into a valid SQL query ONLY.
+    client = get_openai_client()
 
-TABLE NAME: {table_name}
-
-COLUMNS (use exactly these, comma-separated):
-{schema}
-
-RULES:
-- Use only the table `{table_name}`.
-- Do not guess or rename columns; use exactly the provided column names.
-- Return ONLY the SQL query. No explanation, no commentary, no code fences.
-- Ensure the query is a SELECT statement and references the table name.
-
-User Query: {user_query}
-"""
+    prompt = _SQL_PROMPT.format(table_name=table_name, schema=schema, user_query=user_query)
 
     last_exception = None
     for attempt in range(max_retries + 1):
@@ -94,6 +80,9 @@ User Query: {user_query}
                     {"role": "system", "content": "You are a strict SQL generator."},
                     {"role": "user", "content": prompt},
                 ],
+                max_completion_tokens=SQL_MAX_TOKENS,
+                # only deployments configured with stop sequences receive the parameter
+                **({"stop": SQL_STOP_SEQUENCES} if SQL_STOP_SEQUENCES else {}),
             )
             raw_sql = response.choices[0].message.content.strip()
             sql = _clean_model_sql(raw_sql)
@@ -1,22 +1,58 @@
 # backend/upload_utils.py
+import io
 import os
+import re
+import csv
 import logging
 from pathlib import Path
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
 import pandas as pd
-from sqlalchemy import text
+from sqlalchemy import MetaData, Table, Column, BigInteger, Boolean, DateTime, Float, Integer, SmallInteger, Unicode
+from pandas.api.types import (
+    infer_dtype, is_bool_dtype, is_datetime64_any_dtype, is_float_dtype, is_integer_dtype, is_string_dtype,
+)
 from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.utils import secure_filename  # pip install Werkzeug
 
-from backend.database import get_engine
+from backend.database import get_engine, invalidate_schema_cache
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
+
+# Optional: Arrow-backed columns (native string arrays instead of Python objects)
+try:
+    import pyarrow  # noqa: F401
+    _HAS_PYARROW = True
+except ImportError:
+    _HAS_PYARROW = False
 
 # Safety / config
+_TABLE_NAME_RE = re.compile(r"[a-z0-9_]+")  # ASCII only; str.isalnum() would admit unicode letters/digits
 ALLOWED_EXT = {".csv", ".xlsx", ".xls"}
 MAX_ROWS = int(os.environ.get("UPLOAD_MAX_ROWS", 5_000_000))  # hard cap to avoid huge imports
+MAX_FILE_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 2 * 1024**3))  # rejected before parsing
 CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 50_000))  # rows per chunk for to_sql
 DEFAULT_SCHEMA = os.environ.get("DB_DEFAULT_SCHEMA", None)  # e.g., "dbo" or None
+# Concurrent chunk writers (each uses its own pooled connection; keep <= DB_POOL_SIZE)
+UPLOAD_WRITE_WORKERS = int(os.environ.get("UPLOAD_WRITE_WORKERS", 4))
+# Bound on bind parameters per multi-row INSERT (SQL Server allows at most 2100)
+MAX_INSERT_PARAMS = int(os.environ.get("UPLOAD_MAX_INSERT_PARAMS", 2000))
+CSV_NA_VALUES = ["", "NA", "NULL"]  # parsed as missing in addition to pandas' defaults
+# Column kinds found by the type scan and the SQLAlchemy type each one is created as
+_KIND_TYPES = {
+    "bool": Boolean, "smallint": SmallInteger, "integer": Integer, "bigint": BigInteger,
+    "float": Float, "datetime": DateTime, "string": Unicode,
+}
+# Integer kinds from narrowest to widest, with the exclusive bound on their absolute values
+_INTEGER_KINDS = (("smallint", 2**15), ("integer", 2**31), ("bigint", 2**63))
+# Object-column values (pandas.api.types.infer_dtype) mapped to column kinds; anything else is a string
+_INFERRED_KINDS = {
+    "boolean": "bool", "integer": "int", "floating": "float", "mixed-integer-float": "float",
+    "date": "datetime", "datetime": "datetime", "datetime64": "datetime",
+}
 
 
 def _validate_filename(filename: str) -> str:
@@ -27,37 +63,95 @@ def _validate_filename(filename: str) -> str:
     return name
 
 
-def _read_table_from_file(path: str) -> pd.DataFrame:
+def _open_first_sheet(path: str):
+    """
+    Parse the workbook's first sheet with python-calamine (the whole cell range is loaded
+    in native memory), or return None if python-calamine is not installed.
+    """
+    try:
+        from python_calamine import CalamineWorkbook
+    except ImportError:
+        return None
+    return CalamineWorkbook.from_path(path).get_sheet_by_index(0)
+
+
+def _iter_excel_chunks(sheet) -> Iterator[pd.DataFrame]:
+    """
+    Yield a loaded calamine sheet as DataFrames of at most CHUNK_SIZE rows. The sheet's cells
+    are already in native memory; only the pandas side is built one chunk at a time. Cells are
+    left as calamine returns them (numbers as float, dates as date/datetime objects); column
+    types are decided for the whole sheet by _scan_column_types.
+    """
+    rows = sheet.iter_rows()
+    header = next(rows, None)
+    if header is None:
+        return
+    columns = [str(h) if h != "" else f"unnamed_{i}" for i, h in enumerate(header)]
+    # stop one row past the cap so the caller can detect an oversized sheet
+    rows = islice(rows, MAX_ROWS + 1)
+    while batch := list(islice(rows, CHUNK_SIZE)):
+        # calamine returns "" for empty cells
+        yield pd.DataFrame([[None if v == "" else v for v in row] for row in batch], columns=columns)
+
+
+def _read_table_from_file(path: str) -> Callable[[], Iterable[pd.DataFrame]]:
+    """
+    Return a function that opens the file's rows as a fresh iterable of DataFrames of at most
+    CHUNK_SIZE rows, read lazily so only one chunk is in memory at a time (Excel is read whole
+    only without python-calamine). Each call starts a new pass over the file; at most
+    MAX_ROWS + 1 rows are parsed per pass, enough for the caller to detect an oversized file.
+    """
     p = Path(path)
     ext = p.suffix.lower()
     if ext not in ALLOWED_EXT:
         raise ValueError(f"Unsupported file type: {ext}. Allowed: {sorted(ALLOWED_EXT)}")
 
     if ext == ".csv":
-        # Use low_memory=False to avoid dtype inference issues
-        df = pd.read_csv(path, low_memory=False)
-    else:
-        # For Excel files, read the first sheet
-        df = pd.read_excel(path)
-    return df
+        # TextFileReader yields one parsed chunk per iteration. The pyarrow engine cannot
+        # chunk, so the C parser is used with Arrow-backed dtypes when pyarrow is installed.
+        kwargs = {"dtype_backend": "pyarrow"} if _HAS_PYARROW else {}
+        return lambda: pd.read_csv(
+            path, chunksize=CHUNK_SIZE, nrows=MAX_ROWS + 1, low_memory=True, na_values=CSV_NA_VALUES, **kwargs
+        )
+
+    # Parse the sheet once: its dimensions reject oversized files before any DataFrame
+    # is built, and the same sheet object is then iterated for the upload
+    sheet = _open_first_sheet(path)
+    if sheet is None:
+        # python-calamine not installed: pandas' default engine reads the first sheet whole
+        logger.info("python-calamine not installed; using default Excel engine")
+        df = pd.read_excel(path, nrows=MAX_ROWS + 1)
+        return lambda: [df]
+    rows = max(sheet.height - 1, 0)  # minus the header row
+    if rows > MAX_ROWS:
+        raise ValueError(f"File too large: {rows} rows exceeds max allowed {MAX_ROWS}")
+    # Rust-based reader, iterated row by row; much faster and lighter than openpyxl
+    return lambda: _iter_excel_chunks(sheet)
+
+
+@contextmanager
+def _open_chunks(read_chunks: Callable[[], Iterable[pd.DataFrame]]):
+    """Start a pass over the file and release its CSV file handle / Excel row generator afterwards."""
+    chunks = read_chunks()
+    try:
+        yield chunks
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
 
 
 def _normalize_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Normalize column names, drop duplicates, and fill/convert NA safely.
-    This follows the simple rules you had but is more defensive.
+    Normalize column names. Rows are uploaded as-is (duplicates included);
+    NaN/NA values are left in place and to_sql writes them as NULL.
+    Mutates df in place (only the .columns Index is replaced, no data buffers are copied)
+    and returns it; callers pass freshly read chunks they do not reuse.
     """
-    # Normalize column names: strip, lower, replace spaces/hyphens with underscore
-    df = df.copy()
-    df.columns = [
-        str(c).strip().lower().replace(" ", "_").replace("-", "_") for c in df.columns
-    ]
-
-    # Drop duplicate rows
-    df.drop_duplicates(inplace=True)
-
-    # Replace NaN with None for SQL compatibility
-    df = df.where(pd.notnull(df), None)
+    # Normalize column names: strip, lower, replace runs of whitespace/hyphens with underscore
+    df.columns = (
+        df.columns.astype("string").str.strip().str.lower().str.replace(r"[\s\-]+", "_", regex=True)
+    )
 
     return df
 
@@ -67,51 +161,213 @@ def _ensure_table_name_safe(name: str) -> str:
     n = str(name).strip().lower()
     if not n:
         raise ValueError("Table name must not be empty")
-    # allow only alphanumeric and underscores
-    if not all(c.isalnum() or c == "_" for c in n):
+    # allow only ASCII letters, digits and underscores
+    if not _TABLE_NAME_RE.fullmatch(n):
         raise ValueError("Table name may only contain letters, numbers and underscores")
     return n
 
 
-def _to_sql_with_chunks(df: pd.DataFrame, table_name: str, engine, schema: str | None = None):
+def _drop_table(engine, table_name: str, schema: str | None = None):
+    """Drop table_name if it exists (dialect-agnostic; no SQL string interpolation)."""
+    Table(table_name, MetaData(), schema=schema).drop(engine, checkfirst=True)
+
+
+def _copy_insert(table, conn, keys, data_iter):
+    """
+    to_sql insert method for PostgreSQL (psycopg2): stream rows through COPY ... FROM STDIN.
+    """
+    dbapi_conn = conn.connection
+    with dbapi_conn.cursor() as cur:
+        buf = io.StringIO()
+        csv.writer(buf).writerows(data_iter)
+        buf.seek(0)
+        columns = ", ".join(f'"{k}"' for k in keys)
+        table_ref = f'"{table.schema}"."{table.name}"' if table.schema else f'"{table.name}"'
+        cur.copy_expert(f"COPY {table_ref} ({columns}) FROM STDIN WITH CSV", buf)
+
+
+def _insert_method(engine):
+    """
+    Pick the fastest to_sql insert method the engine's dialect/driver supports.
+    """
+    dialect = engine.dialect
+    if dialect.name == "postgresql" and dialect.driver == "psycopg2":
+        return _copy_insert
+    if dialect.name == "mssql" and dialect.driver == "pyodbc":
+        # plain executemany; the engine enables pyodbc fast_executemany (array binding)
+        return None
+    # One INSERT ... VALUES (...), (...) statement per batch instead of one per row
+    return "multi"
+
+
+def _column_kind(series: pd.Series) -> str | None:
     """
-    Write dataframe to SQL in chunks to avoid memory pressure.
-    Uses if_exists='replace' semantics in first chunk and then append.
+    Classify one chunk's column as "bool", "int", "float", "datetime" or "string" from its
+    non-null values, or return None if the chunk has none (no evidence either way).
     """
-    kwargs = {"index": False}
+    values = series.dropna()
+    if values.empty:
+        return None
+    dtype = values.dtype
+    if is_bool_dtype(dtype):
+        return "bool"
+    if is_integer_dtype(dtype):
+        return "int"
+    if is_float_dtype(dtype):
+        # calamine returns every Excel number as float, and numpy-backed CSV chunks turn integer
+        # columns with blanks into float: whole numbers in int64 range count as integers
+        numbers = values.to_numpy(dtype="float64")
+        if (numbers % 1 == 0).all() and np.abs(numbers).max() < 2**63:
+            return "int"
+        return "float"
+    if is_datetime64_any_dtype(dtype):
+        return "datetime"
+    if dtype == object:
+        # mixed-type chunks (low_memory parsing, Excel cells) arrive as Python objects
+        return _INFERRED_KINDS.get(infer_dtype(values, skipna=False), "string")
+    return "string"
+
+
+def _merge_kinds(a: str | None, b: str | None) -> str | None:
+    """Widen two column kinds to one that holds the values of both."""
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    if {a, b} == {"int", "float"}:
+        return "float"
+    # e.g. numbers in one chunk and text in another: store the column as text
+    return "string"
+
+
+def _scan_column_types(read_chunks: Callable[[], Iterable[pd.DataFrame]]) -> tuple[dict[str, str], int]:
+    """
+    Read the whole file once and choose one kind per column (see _KIND_TYPES), widened across
+    all chunks so a value in any chunk fits the created column. Integer columns get the
+    narrowest integer type that holds the file's smallest and largest values. Returns the
+    kinds and the row count; enforces MAX_ROWS before anything is written.
+    """
+    kinds: dict[str, str | None] = {}
+    bounds: dict[str, tuple[int, int]] = {}
+    total = 0
+    with _open_chunks(read_chunks) as chunks:
+        for chunk in chunks:
+            total += len(chunk)
+            if total > MAX_ROWS:
+                raise ValueError(f"File too large: more than {MAX_ROWS} rows")
+            chunk = _normalize_dataframe(chunk)
+            for name in chunk.columns:
+                kind = _column_kind(chunk[name])
+                kinds[name] = _merge_kinds(kinds.get(name), kind)
+                if kind == "int":
+                    lo, hi = int(chunk[name].min()), int(chunk[name].max())
+                    if name in bounds:
+                        lo, hi = min(lo, bounds[name][0]), max(hi, bounds[name][1])
+                    bounds[name] = (lo, hi)
+    for name, kind in kinds.items():
+        if kind == "int":
+            lo, hi = bounds[name]
+            kinds[name] = next(k for k, limit in _INTEGER_KINDS if -limit <= lo and hi < limit)
+    # all-null columns: unbounded NVARCHAR(MAX), like every other string column
+    return {name: kind or "string" for name, kind in kinds.items()}, total
+
+
+def _cast_chunk(df: pd.DataFrame, kinds: dict[str, str]) -> pd.DataFrame:
+    """
+    Cast each column of df in place to its scanned kind, so every chunk is appended with the
+    created table's column types. Raises ValueError naming the column if a value does not fit.
+    """
+    for name, kind in kinds.items():
+        series = df[name]
+        dtype = series.dtype
+        try:
+            if kind == "bool" and not is_bool_dtype(dtype):
+                df[name] = series.astype("boolean")
+            elif kind in ("smallint", "integer", "bigint") and not is_integer_dtype(dtype):
+                df[name] = series.astype("Int64")
+            elif kind == "float" and not is_float_dtype(dtype):
+                df[name] = series.astype("float64")
+            elif kind == "datetime" and not is_datetime64_any_dtype(dtype):
+                df[name] = pd.to_datetime(series)
+            elif kind == "string" and (dtype == object or not is_string_dtype(dtype)):
+                df[name] = series.astype("string")
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Column '{name}' has a value that does not fit its {kind} type: {e}") from e
+    return df
+
+
+def _create_table(kinds: dict[str, str], table_name: str, engine, schema: str | None = None):
+    """
+    CREATE TABLE with the column kinds chosen by _scan_column_types.
+    """
+    columns = [Column(str(name), _KIND_TYPES[kind]()) for name, kind in kinds.items()]
+    Table(table_name, MetaData(), *columns, schema=schema).create(engine)
+
+
+def _to_sql_with_chunks(
+    read_chunks: Callable[[], Iterable[pd.DataFrame]], table_name: str, engine, schema: str | None = None
+) -> int:
+    """
+    Normalize and write each DataFrame from read_chunks() to SQL as it arrives, holding at
+    most UPLOAD_WRITE_WORKERS chunks in memory. The file is read twice: a first pass chooses
+    the column types from every row (and enforces MAX_ROWS), then the table is created with
+    those types and each chunk, cast to them, is appended concurrently from a thread pool.
+    The table is created without indexes or constraints, so there is no per-row index/FK
+    maintenance during the load; add any indexes after the upload completes.
+    Returns the number of rows written.
+    """
+    method = _insert_method(engine)
+    # Excel without calamine arrives as one frame; to_sql batches its rows itself, without DataFrame slicing
+    kwargs = {"index": False, "method": method, "chunksize": CHUNK_SIZE}
     if schema:
         kwargs["schema"] = schema
 
-    # First, drop existing table (replace semantics). Keep in a transaction if supported.
-    with engine.begin() as conn:
-        try:
-            # Remove table if it exists (SQLAlchemy text to avoid reflection issues)
-            drop_sql = f"IF OBJECT_ID(N'{table_name}', N'U') IS NOT NULL DROP TABLE {table_name};"
-            conn.execute(text(drop_sql))
-        except Exception:
-            # ignore if drop fails (table may not exist or dialect differences)
-            logger.debug("Could not drop prior table (may not exist)")
-
-    # Write in chunks
-    total = len(df)
+    # choose column types from the whole file; an oversized or empty file fails here,
+    # before the existing table is touched
+    kinds, total = _scan_column_types(read_chunks)
     if total == 0:
         raise ValueError("Uploaded file contains no rows")
+    if method == "multi":
+        # rows per INSERT statement, kept under the dialect's bind-parameter limit
+        kwargs["chunksize"] = max(1, min(CHUNK_SIZE, MAX_INSERT_PARAMS // max(1, len(kinds))))
+
+    # First, drop existing table (replace semantics).
+    _drop_table(engine, table_name, schema=schema)
 
-    start = 0
-    first_chunk = True
-    while start < total:
-        end = min(start + CHUNK_SIZE, total)
-        chunk = df.iloc[start:end]
+    pending = set()
+    with ThreadPoolExecutor(max_workers=UPLOAD_WRITE_WORKERS) as pool:
         try:
-            if first_chunk:
-                chunk.to_sql(table_name, con=engine, if_exists="replace", **kwargs)
-                first_chunk = False
-            else:
-                chunk.to_sql(table_name, con=engine, if_exists="append", **kwargs)
-        except SQLAlchemyError as e:
-            logger.exception("Failed to write chunk to SQL: %s", e)
+            # fix the schema before any parallel appends start
+            _create_table(kinds, table_name, engine, schema=schema)
+            with _open_chunks(read_chunks) as chunks:
+                for chunk in chunks:
+                    chunk = _cast_chunk(_normalize_dataframe(chunk), kinds)
+
+                    # bound in-flight chunks so at most a few are held in memory
+                    if len(pending) >= UPLOAD_WRITE_WORKERS:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    # each worker checks out its own pooled connection
+                    pending.add(pool.submit(chunk.to_sql, table_name, con=engine, if_exists="append", **kwargs))
+
+            for future in wait(pending).done:
+                future.result()
+        except Exception as e:
+            if isinstance(e, SQLAlchemyError):
+                logger.exception("Failed to write chunk to SQL: %s", e)
+            # stop queued writes and let running ones finish before cleaning up
+            for future in pending:
+                future.cancel()
+            wait(pending)
+            # do not leave a partially written table behind
+            try:
+                _drop_table(engine, table_name, schema=schema)
+            except SQLAlchemyError:
+                logger.exception("Could not drop partially written table %s", table_name)
             raise
-        start = end
+
+    return total
 
 
 def upload_new_table(file_path: str, table_name: str) -> str:
@@ -123,30 +379,28 @@ def upload_new_table(file_path: str, table_name: str) -> str:
     if not path.exists():
         raise FileNotFoundError(f"File not found: {file_path}")
 
+    # reject oversized files before any parser allocates buffers
+    size = path.stat().st_size
+    if size > MAX_FILE_BYTES:
+        raise ValueError(f"File too large: {size} bytes exceeds max allowed {MAX_FILE_BYTES}")
+
     # sanitize and validate names
     _validate_filename(path.name)
     table_name_safe = _ensure_table_name_safe(table_name)
 
-    # read file
-    df = _read_table_from_file(str(path))
-
-    # enforce row limits
-    if len(df) > MAX_ROWS:
-        raise ValueError(f"File too large: {len(df)} rows exceeds max allowed {MAX_ROWS}")
-
-    # normalize dataframe
-    df = _normalize_dataframe(df)
-
-    # if empty after cleaning, raise
-    if df.empty:
-        raise ValueError("No data found after cleaning the uploaded file")
+    # open the file lazily (columns are normalized and rows capped per chunk during upload)
+    read_chunks = _read_table_from_file(str(path))
 
     # upload
     engine = get_engine()
     try:
-        _to_sql_with_chunks(df, table_name_safe, engine, schema=DEFAULT_SCHEMA)
-        return f"Uploaded {len(df)} rows to table '{table_name_safe}' successfully"
+        rows = _to_sql_with_chunks(read_chunks, table_name_safe, engine, schema=DEFAULT_SCHEMA)
+        return f"Uploaded {rows} rows to table '{table_name_safe}' successfully"
     except Exception as e:
         logger.exception("Upload failed: %s", e)
         # Re-raise with a clearer message
         raise RuntimeError(f"Failed to upload table '{table_name_safe}': {e}") from e
+    finally:
+        # the table was dropped and possibly recreated even if the upload failed, so cached
+        # schema lookups are stale either way
+        invalidate_schema_cache()
@@ -1,9 +1,19 @@
 # frontend/app.py
 import os
 import json
+from collections import deque
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+
+# Optional: orjson parses/serializes large payloads several times faster than stdlib json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 from typing import Dict
+from urllib.parse import quote
 
 # --- API base resolution (robust to missing Streamlit secrets) ---
 try:
@@ -11,35 +21,76 @@ try:
 except Exception:
     API_BASE = os.environ.get("API_BASE", "http://127.0.0.1:8000")
 API_BASE = API_BASE.rstrip("/")
+# Keep in sync with the backend's MAX_UPLOAD_SIZE_BYTES so oversized files are not sent at all
+MAX_UPLOAD_SIZE_BYTES = int(os.environ.get("MAX_UPLOAD_SIZE_BYTES", 50 * 1024 * 1024))
+CHAT_HISTORY_MAX = 500  # messages kept per session; older ones are dropped
+CHAT_RENDER_LAST = 50  # messages rendered on each rerun; earlier ones render on demand
+DEBUG_PAYLOAD_MAX_CHARS = 10_000  # cap on debug JSON sent over the Streamlit websocket
 
 # --- Helpers ---
+def _json_loads(content: bytes):
+    return orjson.loads(content) if orjson else json.loads(content)
+
+def _json_dumps_pretty(obj) -> str:
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2, default=str).decode()
+    return json.dumps(obj, indent=2, default=str)
+
+@st.cache_resource
+def _http_session() -> requests.Session:
+    # One pooled keep-alive session shared by every rerun (avoids a TCP handshake per call)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 def ask_graph_agent_api(user_query: str, session_id: str) -> Dict:
     url = f"{API_BASE}/ask_graph_agent"
     try:
-        resp = requests.post(url, json={"user_query": user_query, "session_id": session_id}, timeout=200)
+        resp = _http_session().post(url, json={"user_query": user_query, "session_id": session_id}, timeout=200)
         resp.raise_for_status()
-        return resp.json()
-    except requests.RequestException as e:
+        return _json_loads(resp.content)
+    except (requests.RequestException, ValueError) as e:  # ValueError: malformed JSON body
         return {"error": str(e)}
 
 def upload_new_table_api(file, table_name: str) -> Dict:
     url = f"{API_BASE}/upload_new_table"
-    files = {"file": (file.name, file.getvalue(), file.type or "application/octet-stream")}
-    data = {"table_name": table_name}
+    # Stream the multipart body from the file object instead of copying it with getvalue()
+    file.seek(0)
+    body = MultipartEncoder(fields={
+        "file": (file.name, file, file.type or "application/octet-stream"),
+        "table_name": table_name,
+    })
     try:
-        resp = requests.post(url, files=files, data=data, timeout=120)
+        resp = _http_session().post(url, data=body, headers={"Content-Type": body.content_type}, timeout=120)
         resp.raise_for_status()
         return resp.json()
     except requests.RequestException as e:
         return {"status": "error", "message": f"Upload failed: {e}"}
 
+def clear_session_api(session_id: str) -> Dict:
+    url = f"{API_BASE}/sessions/{quote(session_id, safe='')}"
+    try:
+        resp = _http_session().delete(url, timeout=10)
+        resp.raise_for_status()
+        return _json_loads(resp.content)
+    except (requests.RequestException, ValueError) as e:
+        return {"error": str(e)}
+
+# Streamlit reruns the script on every interaction; probe the backend at most every 10s
+@st.cache_data(ttl=10, show_spinner=False)
 def server_status() -> bool:
     try:
-        resp = requests.get(f"{API_BASE}/health", timeout=5)
+        resp = _http_session().get(f"{API_BASE}/health", timeout=5)
         return resp.status_code == 200
     except Exception:
         return False
 
+def render_message(msg: Dict):
+    with st.chat_message(msg["role"]):
+        st.write(msg["text"])
+
 # --- Page config ---
 st.set_page_config(page_title="Conversational SQL Agent", page_icon="💬", layout="wide")
 
@@ -84,7 +135,11 @@ with st.sidebar:
         if st.button("Reset conversation"):
             key = f"chat_{st.session_state.current_session}"
             st.session_state.pop(key, None)
-            st.success("Conversation reset for this session")
+            result = clear_session_api(st.session_state.current_session)
+            if "error" in result:
+                st.error(f"Could not reset backend history: {result['error']}")
+            else:
+                st.success("Conversation reset for this session")
 
     st.markdown("---")
     st.markdown("### Upload new table")
@@ -93,6 +148,8 @@ with st.sidebar:
     if st.button("Upload"):
         if not uploaded_file or not upload_table_name.strip():
             st.warning("Please provide both a file and a table name.")
+        elif uploaded_file.size > MAX_UPLOAD_SIZE_BYTES:
+            st.error(f"File too large: {uploaded_file.size} bytes exceeds max allowed {MAX_UPLOAD_SIZE_BYTES}")
         else:
             result = upload_new_table_api(uploaded_file, upload_table_name.strip())
             if result.get("status") == "success" or (result.get("status") is None and result.get("message")):
@@ -105,19 +162,20 @@ st.title("Ask your Queries")
 
 session_key = f"chat_{st.session_state.current_session}"
 if session_key not in st.session_state:
-    st.session_state[session_key] = []  # list of {"role": "user"/"assistant", "text": str}
+    # bounded history of {"role": "user"/"assistant", "text": str}
+    st.session_state[session_key] = deque(maxlen=CHAT_HISTORY_MAX)
 
-# Display messages
+# Display messages (only the most recent ones unless older history is requested)
 chat_container = st.container()
 with chat_container:
-    if st.session_state[session_key]:
-        for msg in st.session_state[session_key]:
-            if msg["role"] == "user":
-                with st.chat_message("user"):
-                    st.write(msg["text"])
-            else:
-                with st.chat_message("assistant"):
-                    st.write(msg["text"])
+    chat = list(st.session_state[session_key])
+    if chat:
+        older, recent = chat[:-CHAT_RENDER_LAST], chat[-CHAT_RENDER_LAST:]
+        if older and st.checkbox(f"Show {len(older)} earlier messages", value=False):
+            for msg in older:
+                render_message(msg)
+        for msg in recent:
+            render_message(msg)
     else:
         st.info("Start by asking a question about your data!")
 
@@ -129,6 +187,8 @@ if user_query:
         st.write(user_query)
 
     result = ask_graph_agent_api(user_query=user_query, session_id=st.session_state.current_session)
+    # kept across reruns so the debug panel can still show it after widget interactions
+    st.session_state.last_payload = result
 
     if "error" in result:
         bot_text = f"Error: {result['error']}"
@@ -141,12 +201,12 @@ if user_query:
         with st.chat_message("assistant"):
             st.write(bot_text)
 
-# Debug expander
+# Debug expander (serialized only on request, and truncated)
 with st.expander("Last backend payload (debug)"):
-    try:
-        if 'result' in locals():
-            st.code(json.dumps(result, indent=2), language="json")
-        else:
-            st.write("No backend payload yet.")
-    except Exception:
-        st.write("No payload to display.")
+    if "last_payload" not in st.session_state:
+        st.write("No backend payload yet.")
+    elif st.checkbox("Show debug payload", value=False):
+        try:
+            st.code(_json_dumps_pretty(st.session_state.last_payload)[:DEBUG_PAYLOAD_MAX_CHARS], language="json")
+        except Exception:
+            st.write("No payload to display.")